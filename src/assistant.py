@@ -1,19 +1,64 @@
+import os
+
 import gradio as gr
 from langchain_ollama.llms import OllamaLLM
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
 from langchain.vectorstores.base import VectorStore
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.retrievers import BaseRetriever
+
+from typing import AsyncIterator, List, Optional, Tuple
+import faiss
+import numpy as np
+
+from config import load_config
+from embeddings import get_embeddings
+
+# Similarità coseno minima perché una domanda riusi la risposta di una precedente
+QA_CACHE_THRESHOLD = 0.95
+# Numero massimo di risposte in cache: oltre, si scarta la più vecchia
+QA_CACHE_SIZE = 256
+# Tag dell'LLM che genera la risposta, i cui token vengono inviati all'interfaccia
+ANSWER_LLM_TAG = "answer"
+
+def _document_position(doc: Document) -> Tuple[str, int, int]:
+    """Posizione del chunk nella knowledge base: file sorgente, pagina e indice del chunk."""
+    return (
+        doc.metadata.get("source", ""),
+        doc.metadata.get("page_number", 0),
+        doc.metadata.get("chunk_index", 0)
+    )
+
+class SortedRetriever(BaseRetriever):
+    """
+    Retriever che restituisce i documenti in ordine stabile di posizione invece che di punteggio.
+    A parità di documenti recuperati il contesto nel prompt è identico tra un turno e l'altro,
+    così Ollama può riusare la cache del prefisso comune invece di ricalcolarla.
+    """
+    retriever: BaseRetriever
 
-from typing import Optional
-import yaml
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return sorted(docs, key=_document_position)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return sorted(docs, key=_document_position)
 
 class Assistant:
     def __init__(
         self,
         vectorstore: VectorStore,
         model_name: str = "mistral",
-        retriever_k: int = 25
+        retriever_k: int = 25,
+        keep_alive: str = "1h"
     ):
         """
         Inizializza l'assistente per la chat sui documenti.
@@ -22,58 +67,152 @@ class Assistant:
             vectorstore: Il VectorStore contenente i documenti indicizzati
             model_name: Il nome del modello Ollama da utilizzare
             retriever_k: Numero di documenti da recuperare per ogni query
+            keep_alive: Per quanto tempo Ollama mantiene il modello (e la sua cache
+                del prompt) in memoria dopo l'ultima richiesta
         """
         self.vectorstore = vectorstore
         self.model_name = model_name
         self.retriever_k = retriever_k
+        self.keep_alive = keep_alive
         self.conversation_chain = None
         self.interface = None
+        # Cache semantica delle risposte: indice delle domande e risposte corrispondenti
+        self._qa_cache_index = None
+        self._qa_cache_answers = []
         
         self._read_config()
         self._setup_chain()
     
     def _read_config(self):
-        with open('config.yaml', 'r') as file:
-            config = yaml.safe_load(file)
-
-        self.custom_prompt = config.get('assistant', {}).get('custom_prompt', None)
+        self.custom_prompt = load_config().get('assistant', {}).get('custom_prompt', None)
 
     def _setup_chain(self):
-        """Configura la catena di conversazione con LLM, retriever e memoria."""
-        llm = OllamaLLM(model=self.model_name)
-        
-        custom_prompt = getattr(self, 'custom_prompt', None)
-        params = {
-            "memory_key": "chat_history",
-            "return_messages": True,
-            **({"prompt": custom_prompt} if custom_prompt else {})
-        }
-
-        memory = ConversationBufferMemory(**params)
-
-        retriever = self.vectorstore.as_retriever(
-            search_kwargs={"k": self.retriever_k}
+        """
+        Configura la catena di conversazione con LLM e retriever.
+        La cronologia non è tenuta dalla catena: arriva a ogni richiesta dalla sessione Gradio,
+        così più sessioni possono essere servite in parallelo senza mescolarsi.
+        """
+        # Tenendo il modello caricato tra un turno e l'altro Ollama può riusare
+        # la cache KV del prefisso comune del prompt invece di ricalcolarla
+        llm = OllamaLLM(model=self.model_name, keep_alive=self.keep_alive, tags=[ANSWER_LLM_TAG])
+        # LLM separato per riformulare la domanda, così i suoi token non finiscono nella risposta
+        condense_question_llm = OllamaLLM(model=self.model_name, keep_alive=self.keep_alive)
+        
+        # Il prompt personalizzato sostituisce quello della risposta; le istruzioni statiche
+        # vanno all'inizio, così Ollama riusa la cache del prefisso anche se il contesto cambia
+        combine_docs_chain_kwargs = {}
+        if self.custom_prompt:
+            combine_docs_chain_kwargs["prompt"] = PromptTemplate.from_template(self.custom_prompt)
+        
+        retriever = SortedRetriever(
+            retriever=self.vectorstore.as_retriever(
+                search_kwargs={"k": self.retriever_k}
+            )
         )
         
         self.conversation_chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
-            memory=memory
+            condense_question_llm=condense_question_llm,
+            combine_docs_chain_kwargs=combine_docs_chain_kwargs
         )
     
-    def _chat(self, message: str, history: Optional[list] = None) -> str:
+    @staticmethod
+    def _chat_history(history: Optional[list]) -> List[BaseMessage]:
         """
-        Gestisce una singola interazione di chat.
+        Converte la cronologia della sessione Gradio (formato "messages") nei messaggi della catena.
         
         Args:
-            message: Il messaggio dell'utente
-            history: La cronologia della chat (non utilizzata direttamente)
+            history: La cronologia della chat come lista di dizionari con "role" e "content"
             
         Returns:
-            La risposta del modello
+            I messaggi testuali della conversazione, nell'ordine originale
+        """
+        messages = []
+        for entry in history or []:
+            content = entry.get("content")
+            if not isinstance(content, str):  # Ignora file e altri componenti
+                continue
+            if entry.get("role") == "user":
+                messages.append(HumanMessage(content=content))
+            elif entry.get("role") == "assistant":
+                messages.append(AIMessage(content=content))
+        return messages
+    
+    def _cached_answer(self, query_vector: np.ndarray) -> Optional[str]:
         """
-        result = self.conversation_chain.invoke({"question": message})
-        return result["answer"]
+        Cerca in cache la risposta a una domanda simile a quella posta.
+        
+        Args:
+            query_vector: L'embedding normalizzato della domanda, di forma (1, dim)
+            
+        Returns:
+            La risposta in cache, oppure None se nessuna domanda è abbastanza simile
+        """
+        if self._qa_cache_index is None or self._qa_cache_index.ntotal == 0:
+            return None
+        
+        scores, positions = self._qa_cache_index.search(query_vector, 1)
+        if scores[0, 0] >= QA_CACHE_THRESHOLD:
+            return self._qa_cache_answers[positions[0, 0]]
+        return None
+    
+    def _cache_answer(self, query_vector: np.ndarray, answer: str):
+        """
+        Aggiunge una risposta alla cache, scartando la più vecchia se la cache è piena.
+        
+        Args:
+            query_vector: L'embedding normalizzato della domanda, di forma (1, dim)
+            answer: La risposta del modello
+        """
+        if self._qa_cache_index is None:
+            self._qa_cache_index = faiss.IndexFlatIP(query_vector.shape[1])
+        
+        if self._qa_cache_index.ntotal >= QA_CACHE_SIZE:
+            self._qa_cache_index.remove_ids(np.array([0], dtype=np.int64))
+            self._qa_cache_answers.pop(0)
+        
+        self._qa_cache_index.add(query_vector)
+        self._qa_cache_answers.append(answer)
+    
+    async def _chat(self, message: str, history: Optional[list] = None) -> AsyncIterator[str]:
+        """
+        Gestisce una singola interazione di chat, inviando la risposta man mano che viene generata.
+        
+        Args:
+            message: Il messaggio dell'utente
+            history: La cronologia della sessione, passata da Gradio
+            
+        Yields:
+            La risposta del modello generata fino a quel momento
+        """
+        chat_history = self._chat_history(history)
+        
+        # Con una cronologia la domanda viene riformulata in base al contesto (es. "e il secondo punto?"):
+        # la cache vale solo per le domande autonome, a inizio conversazione
+        query_vector = None
+        if not chat_history:
+            query_vector = np.array([await get_embeddings().aembed_query(message)], dtype=np.float32)
+            faiss.normalize_L2(query_vector)
+            
+            answer = self._cached_answer(query_vector)
+            if answer is not None:
+                yield answer
+                return
+        
+        answer = ""
+        async for event in self.conversation_chain.astream_events(
+            {"question": message, "chat_history": chat_history},
+            version="v2",
+            include_tags=[ANSWER_LLM_TAG]
+        ):
+            if event["event"] == "on_llm_stream":
+                answer += event["data"]["chunk"].text
+                yield answer
+        
+        # Una generazione vuota o interrotta non deve diventare la risposta fissa alla domanda
+        if query_vector is not None and answer.strip():
+            self._cache_answer(query_vector, answer)
     
     def launch_interface(
         self,
@@ -95,7 +234,9 @@ class Assistant:
             fn=self._chat,
             title="Puffo assistente",
             description="Fai domande sulla tua knowledge base",
-            type="messages"
+            type="messages",
+            # Serve in parallelo tante richieste quante Ollama ne elabora contemporaneamente
+            concurrency_limit=int(os.environ.get("OLLAMA_NUM_PARALLEL", 1))
         )
         
         self.interface.launch(
@@ -0,0 +1,21 @@
+import os
+import functools
+
+import yaml
+
+# Il loader in C è disponibile solo se PyYAML è compilato con libyaml
+_SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+@functools.lru_cache(maxsize=1)
+def load_config(path: str = 'config.yaml') -> dict:
+    """
+    Legge il file di configurazione una sola volta per processo.
+    
+    :param path: str - Il percorso del file di configurazione.
+    :return: dict - La configurazione letta dal file, vuota se il file non esiste.
+    """
+    if not os.path.exists(path):
+        return {}
+    
+    with open(path, 'rb') as file:
+        return yaml.load(file, Loader=_SafeLoader) or {}
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain_ollama import OllamaEmbeddings
+from ollama import AsyncClient
+from pydantic import Field, PrivateAttr
+
+# Modello Ollama usato sia per indicizzare i chunks sia per le query
+EMBEDDING_MODEL = "nomic-embed-text"
+
+# Numero di chunks inviati a Ollama in ogni richiesta di embedding
+EMBEDDING_BATCH_SIZE = 64
+
+class ParallelOllamaEmbeddings(OllamaEmbeddings):
+    """
+    OllamaEmbeddings che invia i blocchi di testi in parallelo su più thread tramite il client sincrono,
+    con al più `num_parallel` richieste contemporanee (di default OLLAMA_NUM_PARALLEL).
+    Il client asincrono, legato a un event loop, non viene usato per l'indicizzazione.
+    """
+    batch_size: int = EMBEDDING_BATCH_SIZE
+    num_parallel: int = Field(default_factory=lambda: int(os.environ.get("OLLAMA_NUM_PARALLEL", 4)))
+    # Event loop a cui appartengono le connessioni del client asincrono
+    _async_client_loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Calcola gli embeddings dei testi, a blocchi di `batch_size` inviati in parallelo.
+        
+        :param texts: List[str] - I testi di cui calcolare gli embeddings.
+        :return: List[List[float]] - Gli embeddings, nello stesso ordine dei testi.
+        """
+        if not texts:
+            return []
+        
+        embed_batch = super().embed_documents
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:  # Es. embed_query: nessun bisogno di thread
+            return embed_batch(texts)
+        
+        with ThreadPoolExecutor(max_workers=self.num_parallel) as executor:
+            return [vector for batch in executor.map(embed_batch, batches) for vector in batch]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Calcola gli embeddings dei testi con il client asincrono dell'event loop corrente.
+        Le connessioni del client restano legate al loop in cui sono state aperte:
+        se l'istanza viene usata da un altro loop si crea un nuovo client invece di riusare il pool.
+        
+        :param texts: List[str] - I testi di cui calcolare gli embeddings.
+        :return: List[List[float]] - Gli embeddings, nello stesso ordine dei testi.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client_loop is not loop:
+            self._async_client = AsyncClient(host=self.base_url, **(self.client_kwargs or {}))
+            self._async_client_loop = loop
+        return await super().aembed_documents(texts)
+
+
+@functools.lru_cache(maxsize=1)
+def get_embeddings() -> ParallelOllamaEmbeddings:
+    """
+    Restituisce l'unica istanza di ParallelOllamaEmbeddings del processo, condivisa da indexer e assistente.
+    Si condividono configurazione e client sincrono; il client asincrono è ricreato per ogni event loop.
+    
+    :return: ParallelOllamaEmbeddings - Il modello di embedding condiviso.
+    """
+    return ParallelOllamaEmbeddings(model=EMBEDDING_MODEL)
@@ -1,28 +1,236 @@
 # Standard library imports
 import os
-import glob
+import json
+import math
 import hashlib
+import functools
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
 
 # Third-party imports
-import pypdf
-from langchain.text_splitter import CharacterTextSplitter
+import chromadb
+import faiss
+import numpy as np
+import pymupdf
+import tiktoken
 from langchain.schema import Document
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from config import load_config
+from embeddings import ParallelOllamaEmbeddings, get_embeddings
+
+try:
+    from blake3 import blake3
+except ImportError:  # blake3 è opzionale, in sua assenza si usa hashlib
+    blake3 = None
+
+# Nome della collection Chroma (quello usato in precedenza da langchain_chroma)
+COLLECTION_NAME = "langchain"
+
+# Dimensione e sovrapposizione dei chunks in token (circa 1000 e 200 caratteri)
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 50
+TOKEN_ENCODING = "cl100k_base"
+
+# Se l'encoding di tiktoken non è disponibile (al primo avvio lo scarica da internet)
+# si divide per caratteri, con le dimensioni usate in precedenza
+CHARACTER_CHUNK_SIZE = 1000
+CHARACTER_CHUNK_OVERLAP = 200
+
+# Parametri predefiniti dell'indice FAISS usato dal retriever: sotto IVF_MIN_VECTORS vettori
+# la ricerca esaustiva è già rapida e l'addestramento di IVF/PQ non sarebbe affidabile.
+# ivf_min_vectors e ivf_nprobe si possono sovrascrivere nella sezione "indexer" di config.yaml
+IVF_MIN_VECTORS = 50_000
+IVF_MAX_LISTS = 4096
+IVF_NPROBE = 16
+PQ_SUBQUANTIZERS = 64
+# Minimo di vettori di addestramento richiesto da FAISS: 39 per ogni lista IVF
+# e 256 per i centroidi a 8 bit di ogni sottoquantizzatore PQ
+IVF_MIN_POINTS_PER_LIST = 39
+PQ_MIN_TRAINING_POINTS = 256
+
+# File, nella cartella del vectorstore, con l'indice FAISS addestrato e gli id dei chunks nell'ordine dell'indice
+SEARCH_INDEX_FILE = "search.faiss"
+SEARCH_INDEX_IDS_FILE = "search_ids.json"
+
+def _extract_text_from_pdf(file_path: str) -> Tuple[str, List[dict]]:
+    """
+    Estrae il testo e i metadata da un file PDF, pagina per pagina.
+    Definita a livello di modulo per poter essere eseguita in un ProcessPoolExecutor.
+    
+    :param file_path: str - Il percorso del file PDF da cui estrarre il testo.
+    :return: Tuple[str, List[dict]] - Il percorso del file e la lista di dizionari
+        contenenti il testo e i metadata di ogni pagina.
+    """
+    pages_data = []
+    try:
+        with pymupdf.open(file_path) as pdf:
+            total_pages = pdf.page_count
+            
+            for page_num in range(total_pages):
+                text = pdf.load_page(page_num).get_text("text")
+                if text.strip():  # Salva solo le pagine che contengono testo
+                    page_data = {
+                        'text': text,
+                        'page_number': page_num + 1,
+                        'total_pages': total_pages
+                    }
+                    pages_data.append(page_data)
+            
+            return file_path, pages_data
+            
+    except Exception as e:
+        print(f"Errore nell'elaborazione del file PDF {file_path}: {str(e)}")
+        return file_path, []
+
+def _window_starts(length: int, size: int, overlap: int) -> range:
+    """
+    Posizioni iniziali delle finestre di `size` elementi, sovrapposte di `overlap`, che coprono `length` elementi.
+    L'ultima finestra può essere più corta; una sequenza più corta di una finestra ne produce una sola.
+    
+    :param length: int - Il numero di elementi da coprire.
+    :param size: int - La dimensione di ogni finestra.
+    :param overlap: int - Il numero di elementi in comune tra finestre consecutive.
+    :return: range - Le posizioni iniziali delle finestre.
+    """
+    return range(0, max(length - overlap, 1), size - overlap)
+
+@functools.lru_cache(maxsize=1)
+def _load_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Carica l'encoding di tiktoken usato per dividere i testi.
+    
+    :return: Optional[tiktoken.Encoding] - L'encoding, oppure None se non è disponibile (es. offline).
+    """
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"Encoding {TOKEN_ENCODING} non disponibile, i documenti verranno divisi per caratteri: {str(e)}")
+        return None
+
+def _split_by_tokens(encoding: tiktoken.Encoding, texts: List[str]) -> List[List[str]]:
+    """
+    Divide i testi in finestre di CHUNK_SIZE token, sovrapposte di CHUNK_OVERLAP token.
+    Codifica e decodifica avvengono in batch, su più thread, nel tokenizer Rust di tiktoken.
+    
+    :param encoding: tiktoken.Encoding - L'encoding usato per la tokenizzazione.
+    :param texts: List[str] - I testi da dividere.
+    :return: List[List[str]] - Per ogni testo, la lista dei suoi chunks.
+    """
+    num_threads = os.cpu_count() or 1
+    tokens_batch = encoding.encode_ordinary_batch(texts, num_threads=num_threads)
+    
+    # Finestre di token di tutti i testi, decodificate poi con una sola chiamata
+    windows = []
+    chunk_counts = []
+    for tokens in tokens_batch:
+        starts = _window_starts(len(tokens), CHUNK_SIZE, CHUNK_OVERLAP)
+        windows.extend(tokens[start:start + CHUNK_SIZE] for start in starts)
+        chunk_counts.append(len(starts))
+    
+    # Un taglio tra due token può spezzare un carattere UTF-8: si decodificano i byte
+    # e si scartano quelli incompleti ai bordi (il carattere è intero nella finestra adiacente)
+    chunk_texts = iter([
+        window.decode('utf-8', errors='ignore')
+        for window in encoding.decode_bytes_batch(windows, num_threads=num_threads)
+    ])
+    return [[next(chunk_texts) for _ in range(count)] for count in chunk_counts]
+
+def _split_by_characters(text: str) -> List[str]:
+    """
+    Divide un testo in finestre di CHARACTER_CHUNK_SIZE caratteri, sovrapposte di CHARACTER_CHUNK_OVERLAP.
+    
+    :param text: str - Il testo da dividere.
+    :return: List[str] - La lista dei chunks.
+    """
+    return [
+        text[start:start + CHARACTER_CHUNK_SIZE]
+        for start in _window_starts(len(text), CHARACTER_CHUNK_SIZE, CHARACTER_CHUNK_OVERLAP)
+    ]
+
+@functools.lru_cache(maxsize=None)
+def _hash_file(file_path: str, mtime_ns: int, size: int) -> str:
+    """
+    Calcola l'hash del contenuto di un file leggendolo in streaming (mmap o a blocchi).
+    Data di modifica e dimensione fanno parte della chiave della cache:
+    se il file cambia, l'hash viene ricalcolato.
+    
+    :param file_path: str - Il percorso del file.
+    :param mtime_ns: int - La data di modifica del file in nanosecondi.
+    :param size: int - La dimensione del file in byte.
+    :return: str - L'hash esadecimale del contenuto.
+    """
+    if blake3 is not None:
+        hasher = blake3(max_threads=blake3.AUTO)
+        hasher.update_mmap(file_path)
+    else:
+        with open(file_path, 'rb') as file:
+            hasher = hashlib.file_digest(file, 'blake2b')
+    return hasher.hexdigest()
 
 class Indexer:
     def __init__(self):
         self.persist_directory = "./vector_db"
         self.vectorstore = None
+        self.client = None
         self.collection = None
+        
+        index_config = load_config().get('indexer', {})
+        self.ivf_min_vectors = index_config.get('ivf_min_vectors', IVF_MIN_VECTORS)
+        self.ivf_nprobe = index_config.get('ivf_nprobe', IVF_NPROBE)
+        
+        # Chunks già presenti in Chroma, raggruppati per file sorgente: source -> [(id, metadata)]
+        self._chunks_by_source: Dict[str, List[Tuple[str, dict]]] = {}
+        # Chunks da rimuovere: versioni precedenti dei file reindicizzati e file eliminati
+        self._stale_chunk_ids: List[str] = []
+
+    def _load_indexed_chunks(self, file_paths: List[str]):
+        """
+        Recupera con una sola query i metadata dei chunks già indicizzati per i file indicati.
+        
+        :param file_paths: List[str] - I percorsi dei file candidati all'indicizzazione.
+        """
+        self._chunks_by_source = {}
+        if not file_paths:
+            return
+        
+        try:
+            results = self.collection.get(
+                where={"source": {"$in": file_paths}},
+                include=['metadatas']
+            )
+        except Exception as e:
+            print(f"Errore durante il recupero dei documenti indicizzati: {str(e)}")
+            return
+        
+        for chunk_id, metadata in zip(results['ids'], results['metadatas']):
+            self._chunks_by_source.setdefault(metadata['source'], []).append((chunk_id, metadata))
+
+    def _load_orphan_chunk_ids(self, file_paths: List[str]) -> List[str]:
+        """
+        Recupera gli id dei chunks il cui file sorgente non è più nella knowledge base.
+        
+        :param file_paths: List[str] - I percorsi dei file presenti nella knowledge base.
+        :return: List[str] - Gli id dei chunks dei file eliminati.
+        """
+        try:
+            results = self.collection.get(
+                where={"source": {"$nin": file_paths}} if file_paths else None,
+                include=[]
+            )
+        except Exception as e:
+            print(f"Errore durante il recupero dei documenti eliminati: {str(e)}")
+            return []
+        
+        return results['ids']
 
     def _calculate_hash(self, file_path: Path) -> str:
-        content = file_path.read_bytes()
-        modified_time = str(file_path.stat().st_mtime)
-        return hashlib.md5(content + modified_time.encode()).hexdigest()
+        stat = file_path.stat()
+        return _hash_file(str(file_path), stat.st_mtime_ns, stat.st_size)
 
     def _needs_indexing(self, file_path: str) -> bool:
         """
@@ -36,55 +244,66 @@ class Indexer:
         if not path.exists():
             return False
         
-        current_hash = self._calculate_hash(path)
+        # Cerca tutti i chunks associati al documento
+        indexed_chunks = self._chunks_by_source.get(file_path)
+        if not indexed_chunks:
+            return True  # Il documento non esiste ancora in Chroma
+        
+        stat = path.stat()
+        stored = indexed_chunks[0][1]
+        
+        # Se data di modifica e dimensione coincidono il file non è cambiato:
+        # non serve leggerlo per calcolarne l'hash
+        if stored.get('mtime_ns') == stat.st_mtime_ns and stored.get('size') == stat.st_size:
+            return False
+        
+        # Verifica il content_hash del primo chunk
+        # Se è diverso, il documento è stato modificato
+        if stored.get('content_hash') != self._calculate_hash(path):
+            return True
         
+        # File solo "toccato": aggiorna mtime e dimensione salvati
+        # per evitare di ricalcolare l'hash alla prossima esecuzione
         try:
-            # Cerca tutti i chunks associati al documento
-            results = self.collection.get(
-                where={"source": file_path},
-                include=['metadatas']
+            self.collection.update(
+                ids=[chunk_id for chunk_id, _ in indexed_chunks],
+                metadatas=[
+                    {**metadata, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+                    for _, metadata in indexed_chunks
+                ]
             )
-            
-            if results and results['metadatas']:
-                # Verifica il content_hash del primo chunk
-                # Se è diverso, il documento è stato modificato
-                stored_hash = results['metadatas'][0].get('content_hash')
-                return stored_hash != current_hash
-                
-            return True  # Il documento non esiste ancora in Chroma
-            
         except Exception as e:
-            print(f"Errore durante la verifica del documento: {str(e)}")
-            return True
+            print(f"Errore durante l'aggiornamento del documento: {str(e)}")
+        return False
 
-    def _extract_text_from_pdf(self, file_path: str) -> List[dict]:
+    def _split_documents(self, documents: List[Document]) -> List[Document]:
         """
-        Estrae il testo e i metadata da un file PDF, pagina per pagina.
+        Divide i documenti in chunks di CHUNK_SIZE token, sovrapposti di CHUNK_OVERLAP token,
+        oppure per caratteri se l'encoding di tiktoken non è disponibile.
         
-        :param file_path: str - Il percorso del file PDF da cui estrarre il testo.
-        :return: List[dict] - Lista di dizionari contenenti il testo e i metadata di ogni pagina.
+        :param documents: List[Document] - I documenti da dividere.
+        :return: List[Document] - La lista dei chunks, con chunk_index e total_chunks nei metadata.
         """
-        pages_data = []
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
-                pdf_info = pdf_reader.metadata
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    text = page.extract_text()
-                    if text.strip():  # Salva solo le pagine che contengono testo
-                        page_data = {
-                            'text': text,
-                            'page_number': page_num + 1,
-                            'total_pages': len(pdf_reader.pages)
-                        }
-                        pages_data.append(page_data)
-                
-                return pages_data
-                
-        except Exception as e:
-            print(f"Errore nell'elaborazione del file PDF {file_path}: {str(e)}")
-            return []
+        texts = [doc.page_content for doc in documents]
+        encoding = _load_encoding()
+        if encoding is not None:
+            texts_chunks = _split_by_tokens(encoding, texts)
+        else:
+            texts_chunks = [_split_by_characters(text) for text in texts]
+        
+        chunks = []
+        for doc, text_chunks in zip(documents, texts_chunks):
+            for i, text in enumerate(text_chunks):
+                chunks.append(Document(
+                    page_content=text,
+                    metadata={
+                        **doc.metadata,
+                        "chunk_index": i,
+                        "total_chunks": len(text_chunks)
+                    }
+                ))
+        
+        return chunks
 
     def _process_documents(self, folder_path: str) -> List[Document]:
         """
@@ -94,47 +313,202 @@ class Indexer:
         :param folder_path: str - Il percorso della cartella contenente i documenti PDF.
         :return: List[Document] - La lista dei chunks processati.
         """
-        chunks = []
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        
-        for dir_path in glob.glob(os.path.join(folder_path, '**/'), recursive=True):
-            for file_path in glob.glob(os.path.join(dir_path, '*.pdf')):
-                if not self.collection or self._needs_indexing(file_path=file_path):
-                    pages_data = self._extract_text_from_pdf(file_path)
-                    if pages_data:
-                        content_hash = self._calculate_hash(Path(file_path))
-                        
-                        # Crea un documento per ogni pagina
-                        for page_data in pages_data:
-                            doc = Document(
-                                page_content=page_data['text'],
-                                metadata={
-                                    "source": file_path,
-                                    "date_processed": str(datetime.now()),
-                                    "content_hash": content_hash,
-                                    "chunk_index": -1,  # -1 indica il documento completo
-                                    "file_type": "pdf",
-                                    "page_number": page_data['page_number'],
-                                    "total_pages": page_data['total_pages']
-                                }
-                            )
-                            
-                            # Dividi la pagina in chunks
-                            page_chunks = text_splitter.split_documents([doc])
-                            
-                            # Aggiorna i metadata per ogni chunk
-                            for i, chunk in enumerate(page_chunks):
-                                chunk.metadata.update({
-                                    "chunk_index": i,
-                                    "total_chunks": len(page_chunks),
-                                    "content_hash": content_hash
-                                })
-                            
-                            chunks.extend(page_chunks)
-                else:
-                    print(f"Il documento {file_path} non necessita di reindicizzazione")
+        pages = []
+        # Unico timestamp per tutti i documenti processati in questa esecuzione
+        processed_at = datetime.now().isoformat()
+        
+        candidate_paths = [str(path) for path in sorted(Path(folder_path).rglob('*.pdf'))]
+        self._stale_chunk_ids = []
+        if self.collection:
+            self._load_indexed_chunks(candidate_paths)
+            self._stale_chunk_ids = self._load_orphan_chunk_ids(candidate_paths)
+        
+        # Il controllo dei file da reindicizzare resta seriale: l'estrazione del testo è la parte costosa
+        file_paths = []
+        for file_path in candidate_paths:
+            if not self.collection or self._needs_indexing(file_path=file_path):
+                file_paths.append(file_path)
+                # I chunks della versione precedente vengono sostituiti da quelli nuovi,
+                # anche se ora il file produce meno pagine o chunks
+                self._stale_chunk_ids.extend(
+                    chunk_id for chunk_id, _ in self._chunks_by_source.get(file_path, [])
+                )
+            else:
+                print(f"Il documento {file_path} non necessita di reindicizzazione")
 
-        return chunks
+        if not file_paths:
+            return []
+
+        # Estrae il testo dei PDF in parallelo su più processi;
+        # i Document vengono costruiti nel processo principale
+        with ProcessPoolExecutor() as executor:
+            for file_path, pages_data in executor.map(_extract_text_from_pdf, file_paths, chunksize=4):
+                if pages_data:
+                    path = Path(file_path)
+                    content_hash = self._calculate_hash(path)
+                    stat = path.stat()
+                    
+                    # Crea un documento per ogni pagina
+                    for page_data in pages_data:
+                        pages.append(Document(
+                            page_content=page_data['text'],
+                            metadata={
+                                "source": file_path,
+                                "date_processed": processed_at,
+                                "content_hash": content_hash,
+                                "mtime_ns": stat.st_mtime_ns,
+                                "size": stat.st_size,
+                                "chunk_index": -1,  # -1 indica il documento completo
+                                "file_type": "pdf",
+                                "page_number": page_data['page_number'],
+                                "total_pages": page_data['total_pages']
+                            }
+                        ))
+
+        # Dividi tutte le pagine in chunks in un'unica passata
+        return self._split_documents(pages)
+
+    def _search_index_paths(self) -> Tuple[str, str]:
+        return (
+            os.path.join(self.persist_directory, SEARCH_INDEX_FILE),
+            os.path.join(self.persist_directory, SEARCH_INDEX_IDS_FILE)
+        )
+
+    def _remove_search_index(self):
+        """Elimina l'indice FAISS salvato, che non corrisponde più al contenuto di Chroma."""
+        for path in self._search_index_paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_search_index(self) -> Optional[Tuple[faiss.Index, List[str]]]:
+        """
+        Carica l'indice FAISS salvato, se esiste ed è coerente con la collection.
+        
+        :return: Optional[Tuple[faiss.Index, List[str]]] - L'indice e gli id dei chunks, oppure None.
+        """
+        index_path, ids_path = self._search_index_paths()
+        if not os.path.exists(index_path) or not os.path.exists(ids_path):
+            return None
+        
+        try:
+            index = faiss.read_index(index_path)
+            with open(ids_path, 'r') as file:
+                ids = json.load(file)
+        except Exception as e:
+            print(f"Errore durante il caricamento dell'indice di ricerca: {str(e)}")
+            return None
+        
+        if index.ntotal != len(ids) or len(ids) != self.collection.count():
+            return None
+        
+        # Il tipo di indice dipende da ivf_min_vectors: se la configurazione è cambiata va riaddestrato
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if (ivf_index.nlist if ivf_index is not None else None) != self._ivf_lists(index.ntotal):
+            print("L'indice di ricerca salvato non corrisponde alla configurazione, verrà ricostruito")
+            return None
+        
+        if ivf_index is not None:
+            ivf_index.nprobe = self.ivf_nprobe
+        return index, ids
+
+    def _save_search_index(self, index: faiss.Index, ids: List[str]):
+        """
+        Salva l'indice FAISS addestrato e gli id dei chunks nell'ordine dell'indice.
+        
+        :param index: faiss.Index - L'indice contenente tutti i vettori della collection.
+        :param ids: List[str] - Gli id dei chunks, nella posizione dei rispettivi vettori.
+        """
+        index_path, ids_path = self._search_index_paths()
+        faiss.write_index(index, index_path)
+        with open(ids_path, 'w') as file:
+            json.dump(ids, file)
+
+    def _ivf_lists(self, num_vectors: int) -> Optional[int]:
+        """
+        Numero di liste dell'indice IVF per una collection di num_vectors vettori.
+        
+        :param num_vectors: int - Il numero di vettori da indicizzare.
+        :return: Optional[int] - Il numero di liste, oppure None se va usata la ricerca esaustiva:
+            sotto ivf_min_vectors o con troppi pochi vettori per addestrare IVF/PQ.
+        """
+        nlist = min(IVF_MAX_LISTS, int(4 * math.sqrt(num_vectors)))
+        min_vectors = max(self.ivf_min_vectors, PQ_MIN_TRAINING_POINTS, IVF_MIN_POINTS_PER_LIST * nlist)
+        return nlist if num_vectors >= min_vectors else None
+
+    def _train_search_index(self, vectors: np.ndarray) -> faiss.Index:
+        """
+        Crea e addestra l'indice FAISS sui vettori (normalizzati) e ve li aggiunge.
+        Con pochi vettori usa una ricerca esaustiva su vettori quantizzati a 8 bit,
+        altrimenti un indice IVF con product quantization.
+        
+        :param vectors: np.ndarray - Gli embeddings dei chunks, di forma (n, dim).
+        :return: faiss.Index - L'indice contenente tutti i vettori.
+        """
+        num_vectors, dim = vectors.shape
+        nlist = self._ivf_lists(num_vectors)
+        
+        if nlist is None:
+            # Quantizzazione scalare a 8 bit: un quarto della memoria dei float32
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        else:
+            encoding = f"PQ{PQ_SUBQUANTIZERS}" if dim % PQ_SUBQUANTIZERS == 0 else "SQ8"
+            index = faiss.index_factory(dim, f"IVF{nlist},{encoding}", faiss.METRIC_INNER_PRODUCT)
+            
+            # Addestra i centroidi su un campione dei vettori
+            rng = np.random.default_rng(0)
+            sample = rng.choice(num_vectors, size=min(num_vectors, nlist * 64), replace=False)
+            index.train(vectors[sample])
+            # Numero di liste visitate per query: regola il compromesso tra recall e latenza
+            faiss.extract_index_ivf(index).nprobe = self.ivf_nprobe
+        
+        index.add(vectors)
+        return index
+
+    def _build_search_index(self, embeddings: ParallelOllamaEmbeddings, rebuild: bool) -> FAISS:
+        """
+        Prepara in memoria il vectorstore FAISS usato dal retriever.
+        L'indice salvato viene riusato se la collection non è cambiata; altrimenti viene
+        riaddestrato sugli embeddings salvati in Chroma e salvato accanto al vectorstore.
+        
+        :param embeddings: ParallelOllamaEmbeddings - Il modello usato per calcolare l'embedding delle query.
+        :param rebuild: bool - True se in questa esecuzione sono stati aggiunti o rimossi chunks.
+        :return: FAISS - Il vectorstore FAISS con i chunks indicizzati.
+        """
+        loaded = None if rebuild else self._load_search_index()
+        
+        if loaded is not None:
+            # Servono solo testi e metadata: niente embeddings né addestramento
+            index, ids = loaded
+            results = self.collection.get(ids=ids, include=['documents', 'metadatas'])
+            if len(results['ids']) != len(ids):
+                return self._build_search_index(embeddings, rebuild=True)
+        else:
+            results = self.collection.get(include=['embeddings', 'documents', 'metadatas'])
+            if not results['ids']:
+                raise ValueError("Nessun documento indicizzato nella knowledge base")
+            
+            # Con vettori normalizzati il prodotto scalare equivale alla similarità coseno
+            # (Ollama restituisce già normalizzati gli embeddings delle query)
+            vectors = np.ascontiguousarray(results['embeddings'], dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            
+            index = self._train_search_index(vectors)
+            ids = results['ids']
+            self._save_search_index(index, ids)
+        
+        docstore = InMemoryDocstore({
+            chunk_id: Document(page_content=text, metadata=metadata)
+            for chunk_id, text, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        })
+        
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
 
     def index_knowledge_base(self, folder_path: str):
         """
@@ -142,6 +516,15 @@ class Indexer:
         
         :param folder_path: str - Il percorso della cartella contenente i documenti da indicizzare.
         """
+        embeddings = get_embeddings()
+        
+        # Apre la collection persistita prima di processare i documenti,
+        # così da poter saltare quelli già indicizzati.
+        # Chroma resta l'archivio persistente dei chunks e dei loro embeddings
+        self.client = chromadb.PersistentClient(path=self.persist_directory)
+        # Gli embeddings sono sempre calcolati con Ollama: nessuna embedding function di Chroma
+        self.collection = self.client.get_or_create_collection(COLLECTION_NAME, embedding_function=None)
+        
         # Processa i documenti e ottieni i chunks
         chunks = self._process_documents(folder_path)
         
@@ -150,13 +533,37 @@ class Indexer:
         
         print(f"Processati {len(chunks)} chunks")
         
-        embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        self.vectorstore = Chroma.from_documents(
-            ids=ids,
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=self.persist_directory
-        )
-        print(f"Vectorstore creato con {self.vectorstore._collection.count()} chunks")
+        # Calcola gli embeddings inviando i blocchi di chunks a Ollama in parallelo
+        texts = [doc.page_content for doc in chunks]
+        vectors = embeddings.embed_documents(texts)
+        
+        max_batch_size = self.client.get_max_batch_size()
+        
+        # L'indice di ricerca salvato non sarà più valido: lo si elimina prima di modificare
+        # la collection, così un'interruzione non lascia un indice non allineato
+        changed = bool(chunks or self._stale_chunk_ids)
+        if changed:
+            self._remove_search_index()
+        
+        # Rimuove i chunks dei file modificati o eliminati prima di inserire quelli nuovi
+        if self._stale_chunk_ids:
+            for i in range(0, len(self._stale_chunk_ids), max_batch_size):
+                self.collection.delete(ids=self._stale_chunk_ids[i:i + max_batch_size])
+            print(f"Rimossi {len(self._stale_chunk_ids)} chunks non più validi")
+        
+        # Inserisce tutti i chunks con un solo upsert, spezzandolo solo se supera
+        # il numero massimo di elementi accettato da Chroma in una chiamata
+        if chunks:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            metadatas = [doc.metadata for doc in chunks]
+            for i in range(0, len(chunks), max_batch_size):
+                self.collection.upsert(
+                    ids=ids[i:i + max_batch_size],
+                    embeddings=vectors[i:i + max_batch_size],
+                    documents=texts[i:i + max_batch_size],
+                    metadatas=metadatas[i:i + max_batch_size]
+                )
+        
+        print(f"Vectorstore creato con {self.collection.count()} chunks")
         
-        self.collection = self.vectorstore._collection
\ No newline at end of file
+        self.vectorstore = self._build_search_index(embeddings, rebuild=changed)
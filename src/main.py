@@ -1,6 +1,13 @@
+import os
+
 from indexer import Indexer
 from assistant import Assistant
 
+# Parallelismo di Ollama: il server li legge all'avvio, il client li usa
+# per dimensionare le richieste contemporanee di embedding e di chat
+os.environ.setdefault("OLLAMA_NUM_PARALLEL", "8")
+os.environ.setdefault("OLLAMA_MAX_LOADED_MODELS", "2")
+
 # Esempio di utilizzo
 if __name__ == "__main__":
     documents_folder = "knowledge-base"
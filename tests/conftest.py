@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli in src si importano a vicenda come moduli di primo livello (es. "from config import ...")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,127 @@
+import asyncio
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.vectorstores import InMemoryVectorStore
+
+import assistant
+from assistant import Assistant
+
+
+def _assistant():
+    # Solo lo stato usato dalla cache: nessuna catena né modello Ollama
+    instance = Assistant.__new__(Assistant)
+    instance._qa_cache_index = None
+    instance._qa_cache_answers = []
+    return instance
+
+
+def _unit(i, dim=4):
+    vector = np.zeros((1, dim), dtype=np.float32)
+    vector[0, i] = 1.0
+    return vector
+
+
+def test_cached_answer_miss_on_empty_cache():
+    assert _assistant()._cached_answer(_unit(0)) is None
+
+
+def test_cache_evicts_oldest_answer(monkeypatch):
+    monkeypatch.setattr(assistant, "QA_CACHE_SIZE", 2)
+    instance = _assistant()
+
+    for i, answer in enumerate(["a", "b", "c"]):
+        instance._cache_answer(_unit(i), answer)
+
+    # remove_ids rinumera le voci rimaste: le posizioni devono restare allineate alle risposte
+    assert instance._qa_cache_index.ntotal == 2
+    assert instance._cached_answer(_unit(0)) is None
+    assert instance._cached_answer(_unit(1)) == "b"
+    assert instance._cached_answer(_unit(2)) == "c"
+
+    instance._cache_answer(_unit(3), "d")
+    assert instance._cached_answer(_unit(1)) is None
+    assert instance._cached_answer(_unit(2)) == "c"
+    assert instance._cached_answer(_unit(3)) == "d"
+
+
+def test_chat_history_converts_gradio_messages():
+    history = [
+        {"role": "user", "content": "Ciao"},
+        {"role": "assistant", "content": "Come posso aiutarti?"},
+        {"role": "user", "content": {"path": "file.pdf"}},
+    ]
+
+    assert Assistant._chat_history(history) == [
+        HumanMessage(content="Ciao"),
+        AIMessage(content="Come posso aiutarti?"),
+    ]
+
+
+class FakeChain:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.inputs = []
+
+    async def astream_events(self, inputs, **kwargs):
+        self.inputs.append(inputs)
+        for token in self.tokens:
+            yield {"event": "on_llm_stream", "data": {"chunk": type("Chunk", (), {"text": token})()}}
+
+
+def _collect(generator):
+    async def run():
+        return [item async for item in generator]
+    return asyncio.run(run())
+
+
+def test_chat_skips_cache_for_follow_up_questions(monkeypatch):
+    def fail():
+        raise AssertionError("le domande con cronologia non devono usare la cache")
+    monkeypatch.setattr(assistant, "get_embeddings", fail)
+    instance = _assistant()
+    instance.conversation_chain = FakeChain(["Il ", "secondo"])
+    history = [{"role": "user", "content": "Elenca i punti"}, {"role": "assistant", "content": "1. ... 2. ..."}]
+
+    assert _collect(instance._chat("e il secondo punto?", history)) == ["Il ", "Il secondo"]
+    assert instance._qa_cache_index is None
+    assert len(instance.conversation_chain.inputs[0]["chat_history"]) == 2
+
+
+class FakeEmbeddings:
+    async def aembed_query(self, text):
+        return [1.0, 0.0, 0.0, 0.0]
+
+
+def test_chat_caches_standalone_answers(monkeypatch):
+    monkeypatch.setattr(assistant, "get_embeddings", FakeEmbeddings)
+    instance = _assistant()
+    instance.conversation_chain = FakeChain(["Risposta"])
+
+    assert _collect(instance._chat("Domanda?", [])) == ["Risposta"]
+    assert _collect(instance._chat("Domanda?", [])) == ["Risposta"]
+    assert len(instance.conversation_chain.inputs) == 1
+
+
+def test_chat_does_not_cache_empty_answers(monkeypatch):
+    monkeypatch.setattr(assistant, "get_embeddings", FakeEmbeddings)
+    instance = _assistant()
+    instance.conversation_chain = FakeChain(["", " "])
+
+    assert _collect(instance._chat("Domanda?", [])) == ["", " "]
+    assert instance._qa_cache_index is None
+
+    instance.conversation_chain.tokens = ["Risposta"]
+    assert _collect(instance._chat("Domanda?", [])) == ["Risposta"]
+
+
+def test_custom_prompt_replaces_answer_prompt(monkeypatch):
+    template = "Rispondi in italiano.\n{context}\nDomanda: {question}"
+    monkeypatch.setattr(assistant, "load_config", lambda: {"assistant": {"custom_prompt": template}})
+
+    instance = Assistant(vectorstore=InMemoryVectorStore(DeterministicFakeEmbedding(size=8)))
+
+    prompt = instance.conversation_chain.combine_docs_chain.llm_chain.prompt
+    assert prompt.template == template
+    assert set(prompt.input_variables) == {"context", "question"}
@@ -0,0 +1,298 @@
+import os
+
+import chromadb
+import faiss
+import numpy as np
+import pymupdf
+import pytest
+from langchain.schema import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import indexer
+from indexer import Indexer, _split_by_characters, _split_by_tokens, _window_starts
+
+
+class FakeCollection:
+    """Collection Chroma in memoria: supporta solo i filtri usati dall'indexer."""
+
+    def __init__(self, chunks):
+        self.chunks = dict(chunks)
+        self.updates = []
+
+    def get(self, where=None, include=None, ids=None):
+        items = list(self.chunks.items())
+        if where is not None:
+            condition = where["source"]
+            if "$in" in condition:
+                items = [(i, m) for i, m in items if m["source"] in condition["$in"]]
+            else:
+                items = [(i, m) for i, m in items if m["source"] not in condition["$nin"]]
+        return {"ids": [i for i, _ in items], "metadatas": [m for _, m in items]}
+
+    def update(self, ids, metadatas):
+        self.updates.append((ids, metadatas))
+        self.chunks.update(zip(ids, metadatas))
+
+    def count(self):
+        return len(self.chunks)
+
+
+class ByteEncoding:
+    """Encoding in cui ogni byte UTF-8 è un token: permette di spezzare i caratteri multi-byte."""
+
+    def encode_ordinary_batch(self, texts, num_threads=1):
+        return [list(text.encode("utf-8")) for text in texts]
+
+    def decode_bytes_batch(self, batch, num_threads=1):
+        return [bytes(tokens) for tokens in batch]
+
+
+def _metadata(file_path, content_hash="hash", **overrides):
+    stat = os.stat(file_path)
+    return {
+        "source": str(file_path),
+        "content_hash": content_hash,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        **overrides,
+    }
+
+
+def _indexer(chunks):
+    idx = Indexer()
+    idx.collection = FakeCollection(chunks)
+    return idx
+
+
+def test_needs_indexing_new_file(tmp_path):
+    pdf = tmp_path / "new.pdf"
+    pdf.write_bytes(b"contenuto")
+    idx = _indexer([])
+    idx._load_indexed_chunks([str(pdf)])
+
+    assert idx._needs_indexing(str(pdf)) is True
+
+
+def test_needs_indexing_skips_hashing_when_mtime_and_size_match(tmp_path, monkeypatch):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"contenuto")
+    idx = _indexer([("doc_1_0", _metadata(pdf))])
+    idx._load_indexed_chunks([str(pdf)])
+
+    def fail(*args):
+        raise AssertionError("il file non deve essere letto")
+    monkeypatch.setattr(indexer, "_hash_file", fail)
+
+    assert idx._needs_indexing(str(pdf)) is False
+
+
+def test_needs_indexing_detects_modified_content(tmp_path):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"contenuto")
+    idx = _indexer([("doc_1_0", _metadata(pdf, content_hash="hash vecchio", size=0))])
+    idx._load_indexed_chunks([str(pdf)])
+
+    assert idx._needs_indexing(str(pdf)) is True
+    assert idx.collection.updates == []
+
+
+def test_needs_indexing_refreshes_metadata_of_touched_file(tmp_path):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"contenuto")
+    idx = _indexer([])
+    content_hash = idx._calculate_hash(pdf)
+    stored = _metadata(pdf, content_hash=content_hash, mtime_ns=1)
+    idx.collection = FakeCollection([("doc_1_0", stored), ("doc_1_1", dict(stored))])
+    idx._load_indexed_chunks([str(pdf)])
+
+    assert idx._needs_indexing(str(pdf)) is False
+
+    [(ids, metadatas)] = idx.collection.updates
+    assert ids == ["doc_1_0", "doc_1_1"]
+    assert all(m["mtime_ns"] == pdf.stat().st_mtime_ns and m["content_hash"] == content_hash for m in metadatas)
+
+
+def test_load_indexed_chunks_groups_by_source(tmp_path):
+    idx = _indexer([
+        ("a_1_0", {"source": "a.pdf"}),
+        ("a_1_1", {"source": "a.pdf"}),
+        ("b_1_0", {"source": "b.pdf"}),
+        ("c_1_0", {"source": "c.pdf"}),
+    ])
+
+    idx._load_indexed_chunks(["a.pdf", "b.pdf"])
+
+    assert {source: [i for i, _ in chunks] for source, chunks in idx._chunks_by_source.items()} == {
+        "a.pdf": ["a_1_0", "a_1_1"],
+        "b.pdf": ["b_1_0"],
+    }
+
+
+@pytest.mark.parametrize("length, expected", [
+    (0, [0]),
+    (3, [0]),     # più corto della sovrapposizione
+    (10, [0]),    # esattamente una finestra
+    (11, [0, 6]), # l'ultima finestra contiene solo la sovrapposizione più un elemento
+    (22, [0, 6, 12]),
+])
+def test_window_starts(length, expected):
+    assert list(_window_starts(length, 10, 4)) == expected
+
+
+def test_split_by_tokens_covers_text_with_overlap(monkeypatch):
+    monkeypatch.setattr(indexer, "CHUNK_SIZE", 10)
+    monkeypatch.setattr(indexer, "CHUNK_OVERLAP", 4)
+
+    chunks = _split_by_tokens(ByteEncoding(), ["abcdefghijklmnop", "ab"])
+
+    assert chunks == [["abcdefghij", "ghijklmnop"], ["ab"]]
+
+
+def test_split_by_tokens_drops_partial_utf8_at_window_edges(monkeypatch):
+    monkeypatch.setattr(indexer, "CHUNK_SIZE", 5)
+    monkeypatch.setattr(indexer, "CHUNK_OVERLAP", 2)
+    text = "àèìòù"  # 2 byte per carattere: ogni finestra di 5 byte ne spezza uno
+
+    [chunks] = _split_by_tokens(ByteEncoding(), [text])
+
+    assert all("�" not in chunk for chunk in chunks)
+    assert all(chunk in text for chunk in chunks)
+    assert chunks[0] == "àè" and chunks[-1].endswith("ù")
+
+
+def test_split_by_characters_trailing_window():
+    text = "x" * 1801
+
+    assert [len(chunk) for chunk in _split_by_characters(text)] == [1000, 1000, 201]
+    assert _split_by_characters("breve") == ["breve"]
+
+
+def test_split_documents_falls_back_to_characters(monkeypatch):
+    monkeypatch.setattr(indexer, "_load_encoding", lambda: None)
+    pages = [
+        Document(page_content="a" * 1500, metadata={"source": "a.pdf", "page_number": 1}),
+        Document(page_content="b" * 10, metadata={"source": "a.pdf", "page_number": 2}),
+    ]
+
+    chunks = Indexer()._split_documents(pages)
+
+    assert [(c.metadata["page_number"], c.metadata["chunk_index"], c.metadata["total_chunks"]) for c in chunks] == [
+        (1, 0, 2), (1, 1, 2), (2, 0, 1)
+    ]
+    assert chunks[1].page_content == "a" * 700
+
+
+def test_process_documents_collects_stale_chunks(tmp_path):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"non un pdf")  # L'estrazione fallisce: nessun nuovo chunk
+    idx = _indexer([
+        ("doc_1_0", _metadata(pdf, content_hash="hash vecchio", size=0)),
+        ("doc_2_0", _metadata(pdf, content_hash="hash vecchio", size=0)),
+        ("gone_1_0", {"source": str(tmp_path / "gone.pdf")}),
+    ])
+
+    chunks = idx._process_documents(str(tmp_path))
+
+    assert chunks == []
+    assert sorted(idx._stale_chunk_ids) == ["doc_1_0", "doc_2_0", "gone_1_0"]
+
+
+def _normalized_vectors(num_vectors, dim):
+    vectors = np.random.default_rng(0).standard_normal((num_vectors, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def test_ivf_lists_requires_enough_training_points():
+    idx = Indexer()
+    idx.ivf_min_vectors = 0
+
+    # 39 punti per lista: con nlist = 4 * sqrt(n) servono circa 24300 vettori
+    assert idx._ivf_lists(150) is None
+    assert idx._ivf_lists(24_000) is None
+    assert idx._ivf_lists(24336) == 624
+    assert idx._ivf_lists(2_000_000) == indexer.IVF_MAX_LISTS
+
+    idx.ivf_min_vectors = 50_000
+    assert idx._ivf_lists(30_000) is None
+
+
+def test_train_search_index_falls_back_below_training_minimum():
+    idx = Indexer()
+    idx.ivf_min_vectors = 100
+    vectors = _normalized_vectors(150, 768)
+
+    index = idx._train_search_index(vectors)
+
+    assert faiss.try_extract_index_ivf(index) is None
+    assert index.ntotal == 150
+
+
+def test_load_search_index_rebuilds_after_config_change(tmp_path):
+    vectors = _normalized_vectors(25_000, 48)  # IVF,SQ8: addestramento rapido
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    idx = _indexer([(chunk_id, {"source": "doc.pdf"}) for chunk_id in ids])
+    idx.persist_directory = str(tmp_path)
+    idx.ivf_min_vectors = 0
+    idx._save_search_index(idx._train_search_index(vectors), ids)
+
+    idx.ivf_nprobe = 4
+    index, loaded_ids = idx._load_search_index()
+    assert loaded_ids == ids
+    assert faiss.extract_index_ivf(index).nprobe == 4
+
+    # Con la nuova soglia la collection va servita dall'indice esaustivo
+    idx.ivf_min_vectors = 50_000
+    assert idx._load_search_index() is None
+
+
+def _write_pdf(path, pages):
+    with pymupdf.open() as pdf:
+        for text in pages:
+            pdf.new_page().insert_text((72, 72), text)
+        pdf.save(str(path))
+
+
+def _index(persist_directory, folder):
+    idx = Indexer()
+    idx.persist_directory = str(persist_directory)
+    idx.index_knowledge_base(str(folder))
+    return idx
+
+
+def test_index_knowledge_base_replaces_stale_chunks(tmp_path, monkeypatch):
+    # Embeddings deterministici al posto di Ollama, testo diviso per caratteri e
+    # lotti da 2 elementi per Chroma, così upsert e delete vengono spezzati
+    monkeypatch.setattr(indexer, "get_embeddings", lambda: DeterministicFakeEmbedding(size=16))
+    monkeypatch.setattr(indexer, "_load_encoding", lambda: None)
+    monkeypatch.setattr(chromadb.api.client.Client, "get_max_batch_size", lambda self: 2)
+    persist_directory = tmp_path / "vector_db"
+    folder = tmp_path / "knowledge-base"
+    folder.mkdir()
+    manual, notes = folder / "manuale.pdf", folder / "note.pdf"
+    _write_pdf(manual, ["Capitolo uno", "Capitolo due", "Capitolo tre"])
+    _write_pdf(notes, ["Appunti"])
+
+    idx = _index(persist_directory, folder)
+    assert sorted(idx.collection.get()["ids"]) == [
+        f"{manual}_1_0", f"{manual}_2_0", f"{manual}_3_0", f"{notes}_1_0"
+    ]
+    assert idx.vectorstore.index.ntotal == 4
+
+    # Nessun file cambiato: l'indice salvato viene riusato senza riaddestrarlo
+    def fail(*args):
+        raise AssertionError("l'indice di ricerca non deve essere riaddestrato")
+    with monkeypatch.context() as patch:
+        patch.setattr(Indexer, "_train_search_index", fail)
+        idx = _index(persist_directory, folder)
+    assert idx.vectorstore.index.ntotal == 4
+
+    # Un file perde pagine, l'altro viene eliminato
+    _write_pdf(manual, ["Capitolo uno riscritto"])
+    notes.unlink()
+
+    idx = _index(persist_directory, folder)
+    assert idx.collection.get()["ids"] == [f"{manual}_1_0"]
+    assert idx.vectorstore.index.ntotal == 1
+    [doc] = idx.vectorstore.similarity_search("Capitolo", k=1)
+    assert doc.page_content.strip() == "Capitolo uno riscritto"